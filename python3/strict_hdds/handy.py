@@ -25,10 +25,10 @@ import os
 import re
 import abc
 import copy
-import glob
 import time
 import struct
 import parted
+import concurrent.futures
 from .util import Util, PartiUtil, GptUtil, BcacheUtil, LvmUtil, PhysicalDiskMounts, TmpMount
 from . import errors
 from . import MountEntry
@@ -90,6 +90,10 @@ class EfiMultiDisk:
         assert dst is not None and dst in self.get_pending_esp_list()
         Util.syncBlkDev(self.get_esp(), dst, mountPoint1=Util.bootDir)
 
+    def sync_all_esps(self):
+        # pending ESPs are on different disks, sync them simultaneously
+        _parallelMap(self.sync_esp, self.get_pending_esp_list())
+
     def get_disk_list(self):
         return self._hddList
 
@@ -113,6 +117,7 @@ class EfiMultiDisk:
         # partition1: pending ESP partition
         parti = PartiUtil.diskToParti(disk, 1)
         Util.cmdCall("mkfs.vfat", parti)
+        Util.invalidateBlkDevInfoCache()
         if self._bootHdd is not None:
             Util.syncBlkDev(PartiUtil.diskToParti(self._bootHdd, 1), parti, mountPoint1=Util.bootDir)
         else:
@@ -192,9 +197,10 @@ class EfiCacheGroup:
         assert self._ssdSwapParti == ssdSwapParti
         assert self._ssdCacheParti == ssdCacheParti
 
-        # assign self._hddList
+        # assign self._hddList and self._hddSet
         assert hddList is not None
         self._hddList = sorted(hddList)
+        self._hddSet = frozenset(self._hddList)
 
         # assign self._bootHdd
         if self._ssd is not None:
@@ -241,6 +247,10 @@ class EfiCacheGroup:
         assert dst is not None and dst in self.get_pending_esp_list()
         Util.syncBlkDev(self.get_esp(), dst, mountPoint1=Util.bootDir)
 
+    def sync_all_esps(self):
+        # pending ESPs are on different disks, sync them simultaneously
+        _parallelMap(self.sync_esp, self.get_pending_esp_list())
+
     def get_disk_list(self):
         if self._ssd is not None:
             return [self._ssd] + self._hddList
@@ -270,12 +280,15 @@ class EfiCacheGroup:
     def get_hdd_list(self):
         return self._hddList
 
+    def get_hdd_set(self):
+        return self._hddSet
+
     def get_hdd_esp_partition(self, disk):
-        assert disk in self._hddList
+        assert disk in self._hddSet
         return PartiUtil.diskToParti(disk, 1)
 
     def get_hdd_data_partition(self, disk):
-        assert disk in self._hddList
+        assert disk in self._hddSet
         return PartiUtil.diskToParti(disk, 2)
 
     def get_swap_size(self):
@@ -300,6 +313,7 @@ class EfiCacheGroup:
 
         # partition1: ESP partition
         Util.cmdCall("mkfs.vfat", self._ssdEspParti)
+        Util.invalidateBlkDevInfoCache()
         if self._bootHdd is not None:
             Util.syncBlkDev(PartiUtil.diskToParti(self._bootHdd, 1), self._ssdEspParti, mountPoint1=Util.bootDir)
         else:
@@ -307,6 +321,7 @@ class EfiCacheGroup:
 
         # partition2: swap partition
         Util.cmdCall("mkswap", self._ssdSwapParti)
+        Util.invalidateBlkDevInfoCache()
 
         # partition3: cache partition, leave it to caller
         pass
@@ -315,6 +330,9 @@ class EfiCacheGroup:
         if self._bootHdd is not None:
             self._unsetCurrentBootHdd()
 
+        # return the cache partition so that caller needs no extra lookup
+        return self._ssdCacheParti
+
     def remove_ssd(self):
         assert self._ssd is not None
 
@@ -349,6 +367,7 @@ class EfiCacheGroup:
         # partition1: pending ESP partition
         parti = PartiUtil.diskToParti(hdd, 1)
         Util.cmdCall("mkfs.vfat", parti)
+        Util.invalidateBlkDevInfoCache()
         if self._ssd is not None:
             Util.syncBlkDev(self._ssdEspParti, parti, mountPoint1=Util.bootDir)
         elif self._bootHdd is not None:
@@ -362,12 +381,16 @@ class EfiCacheGroup:
         # record result
         self._hddList.append(hdd)
         self._hddList.sort()
+        self._hddSet = self._hddSet | {hdd}
 
         # change boot disk if needed
         if self._ssd is None and self._bootHdd is None:
             assert len(self._hddList) == 1
             self._setFirstHddAsBootHdd()
 
+        # return the data partition so that caller needs no extra lookup
+        return PartiUtil.diskToParti(hdd, 2)
+
     def remove_hdd(self, hdd):
         assert hdd is not None and hdd in self._hddList
 
@@ -380,6 +403,7 @@ class EfiCacheGroup:
                 bChange = True
 
         self._hddList.remove(hdd)
+        self._hddSet = self._hddSet - {hdd}
         Util.wipeHarddisk(hdd)
 
         # boot device change
@@ -436,31 +460,12 @@ class Bcache:
         return list(self._backingDict.values())
 
     def add_cache(self, cacheDevPath):
-        BcacheUtil.makeAndRegisterCacheDevice(cacheDevPath)
-        BcacheUtil.attachCacheDevice(self._backingDict.values(), cacheDevPath)
+        BcacheUtil.makeRegisterAndAttachCacheDevice(cacheDevPath, self._backingDict.values())
         self._cacheDevSet.add(cacheDevPath)
 
     def add_backing(self, cacheDevPath, key, devPath):
         BcacheUtil.makeAndRegisterBackingDevice(devPath)
-
-        bcacheDevPath = None
-        if True:
-            devName = os.path.basename(devPath)
-            bcacheSet = set()
-            for i in range(0, 10):
-                for fullfn in glob.glob("/dev/bcache*"):
-                    if fullfn not in bcacheSet:
-                        if re.fullmatch("/dev/bcache[0-9]+", fullfn):
-                            bcachePath = os.path.realpath("/sys/block/" + devName + "/bcache")
-                            if os.path.basename(os.path.dirname(bcachePath)) == devName:
-                                bcacheDevPath = fullfn
-                                break
-                    bcacheSet.add(fullfn)
-                if bcacheDevPath is not None:
-                    break
-                time.sleep(1)
-            if bcacheDevPath is None:
-                raise Exception("corresponding bcache device is not found")
+        bcacheDevPath = self._waitBcacheDevList([devPath])[0]
 
         if cacheDevPath is not None:
             BcacheUtil.attachCacheDevice([bcacheDevPath], cacheDevPath)
@@ -468,6 +473,22 @@ class Bcache:
         self._backingDict[key] = bcacheDevPath
         return bcacheDevPath
 
+    def add_backing_list(self, cacheDevPath, keyList, devPathList):
+        assert len(keyList) == len(devPathList)
+
+        if len(devPathList) == 0:
+            return []
+
+        # workers block in device write and sysfs registration, so backing devices can be created simultaneously
+        _parallelMap(BcacheUtil.makeAndRegisterBackingDevice, devPathList)
+        bcacheDevPathList = self._waitBcacheDevList(devPathList)
+
+        if cacheDevPath is not None:
+            BcacheUtil.attachCacheDevice(bcacheDevPathList, cacheDevPath)
+
+        self._backingDict.update(zip(keyList, bcacheDevPathList))
+        return bcacheDevPathList
+
     def remove_cache(self, cacheDevPath):
         BcacheUtil.unregisterCacheDevice(cacheDevPath)
         self._cacheDevSet.remove(cacheDevPath)
@@ -477,8 +498,20 @@ class Bcache:
         del self._backingDict[key]
 
     def stop_all(self):
-        for bcacheDevPath in self._backingDict.values():
-            BcacheUtil.stopBackingDevice(bcacheDevPath)
+        # the caller must have unmounted the file system on the bcache devices
+        # stopping a backing device waits for its dirty data to be flushed, so stop them simultaneously
+        _parallelMap(BcacheUtil.stopBackingDevice, list(self._backingDict.values()))
+
+    @staticmethod
+    def _waitBcacheDevList(devPathList):
+        # bcache devices are created asynchronously after the backing devices are registered
+        # one sysfs walk per round is shared by all the backing devices
+        for i in range(0, 10):
+            backingDict = BcacheUtil.getBackingDevDict()
+            if all(x in backingDict for x in devPathList):
+                return [backingDict[x] for x in devPathList]
+            time.sleep(1)
+        raise Exception("corresponding bcache device is not found")
 
     def check(self, auto_fix=False, error_callback=None):
         # check mode is consistent
@@ -527,11 +560,13 @@ class SwapLvmLv:
     def create_swap_lv(self):
         assert not self._bSwapLv
         Util.cmdCall("lvm", "lvcreate", "-L", "%dGiB" % (Util.getSwapSizeInGb()), "-n", LvmUtil.swapLvName, LvmUtil.vgName)
+        Util.invalidateBlkDevInfoCache()
         self._bSwapLv = True
 
     def remove_swap_lv(self):
         assert self._bSwapLv
         Util.cmdCall("lvm", "lvremove", LvmUtil.swapLvDevPath)
+        Util.invalidateBlkDevInfoCache()
         self._bSwapLv = False
 
     def get_swap_size(self):
@@ -601,6 +636,8 @@ class SwapFile:
 
 class Snapshot(abc.ABC):
 
+    _snapshotSubVolPattern = re.compile("@snapshots/([^/]+)/snapshot")
+
     @classmethod
     def initializeFs(cls, devPath, mntOptList):
         with TmpMount(devPath, options=",".join(mntOptList)) as mp:
@@ -666,7 +703,7 @@ class Snapshot(abc.ABC):
     def get_snapshot_list(self):
         ret = []
         for sv in self._getSubVolList():
-            m = re.fullmatch("@snapshots/([^/]+)/snapshot", sv)
+            m = self._snapshotSubVolPattern.fullmatch(sv)
             if m is not None:
                 ret.append(m.group(1))
         return ret
@@ -709,7 +746,7 @@ class Snapshot(abc.ABC):
                 # sub-volumes created by other programs
                 pass
             elif sv.startswith("@snapshots/"):
-                if not re.fullmatch("@snapshots/[^/]+/snapshot", sv):
+                if not self._snapshotSubVolPattern.fullmatch(sv):
                     error_callback(errors.CheckCode.TRIVIAL, "Redundant sub-volume \"%s\"." % (sv))     # too dangerous to auto fix
             else:
                 error_callback(errors.CheckCode.TRIVIAL, "Redundant sub-volume \"%s\"." % (sv))         # too dangerous to auto fix
@@ -761,6 +798,8 @@ class Snapshot(abc.ABC):
 
 class SnapshotBtrfs(Snapshot):
 
+    _subVolListPattern = re.compile("path (\\S+)", re.M)
+
     @staticmethod
     def _createSubVol(mntDir, subVolPath):
         Util.cmdCall("btrfs", "subvolume", "create", os.path.join(mntDir, subVolPath))
@@ -777,7 +816,7 @@ class SnapshotBtrfs(Snapshot):
     def _getSubVolList(mntDir):
         ret = []
         out = Util.cmdCall("btrfs", "subvolume", "list", mntDir)
-        for m in re.finditer("path (\\S+)", out, re.M):
+        for m in SnapshotBtrfs._subVolListPattern.finditer(out):
             ret.append(m.group(1))
         return ret
 
@@ -999,9 +1038,10 @@ class HandyMd:
 
     @staticmethod
     def checkExtraDisks(storageLayoutName, diskList, origDiskList):
-        d = list(set(diskList) - set(origDiskList))
-        if len(d) > 0:
-            raise errors.StorageLayoutParseError(storageLayoutName, "extra disk \"%s\" needed" % (d[0]))
+        origDiskSet = frozenset(origDiskList)
+        d = next((x for x in diskList if x not in origDiskSet), None)
+        if d is not None:
+            raise errors.StorageLayoutParseError(storageLayoutName, "extra disk \"%s\" needed" % (d))
 
     @staticmethod
     def checkAndGetBootDiskFromBootDev(storageLayoutName, bootDev, diskList):
@@ -1093,9 +1133,10 @@ class HandyCg:
     def checkExtraDisks(storageLayoutName, ssd, hddList, origDiskList):
         if ssd is not None and ssd not in origDiskList:
             raise errors.StorageLayoutParseError(storageLayoutName, "extra disk \"%s\" needed" % (ssd))
-        d = list(set(hddList) - set(origDiskList))
-        if len(d) > 0:
-            raise errors.StorageLayoutParseError(storageLayoutName, "extra disk \"%s\" needed" % (d[0]))
+        origDiskSet = frozenset(origDiskList)
+        d = next((x for x in hddList if x not in origDiskSet), None)
+        if d is not None:
+            raise errors.StorageLayoutParseError(storageLayoutName, "extra disk \"%s\" needed" % (d))
 
     @staticmethod
     def checkAndGetBootHddFromBootDev(storageLayoutName, bootDev, ssdEspParti, hddList):
@@ -1109,7 +1150,7 @@ class HandyCg:
         else:
             espParti = HandyUtil._mcCheckAndGetEspParti(storageLayoutName, hddList, mustHave=True)
             if espParti != bootDev:
-                raise errors.StorageLayoutParseError(storageLayoutName, errors.BOOT_DEV_MUST_BE(ssdEspParti))
+                raise errors.StorageLayoutParseError(storageLayoutName, errors.BOOT_DEV_MUST_BE(espParti))
             return PartiUtil.partiToDisk(espParti)
 
     @staticmethod
@@ -1296,6 +1337,12 @@ class DisksChecker:
 
 class HandyUtil:
 
+    _lvmPvListCache = (None, None, 0.0)        # (signature, pvList, timestamp)
+
+    _lvmPvPattern = re.compile("(/dev/\\S+):%s:.*" % (LvmUtil.vgName), re.M)
+    _lvmRootLvPattern = re.compile("/dev/hdd/root:%s:.*" % (LvmUtil.vgName), re.M)
+    _lvmSwapLvPattern = re.compile("/dev/hdd/swap:%s:.*" % (LvmUtil.vgName), re.M)
+
     @staticmethod
     def checkMntOptList(mntOptList):
         tset = set()
@@ -1321,6 +1368,14 @@ class HandyUtil:
 
     @staticmethod
     def lvmEnsureVgLvAndGetPvList(storageLayoutName):
+        # parse() and detect_and_mount() both call us, reuse the result for a few seconds if the vg metadata is not changed
+        # we invalidate the cache explicitly when we change the vg, changes made by others are caught by the signature
+        # if lvm keeps metadata backup, or else only expire with the 5 seconds ttl
+        sig = HandyUtil._lvmGetStateSignature()
+        cachedSig, pvList, ts = HandyUtil._lvmPvListCache
+        if pvList is not None and cachedSig == sig and time.monotonic() - ts < 5.0:
+            return list(pvList)
+
         # check vg
         if not Util.cmdCallTestSuccess("lvm", "vgdisplay", LvmUtil.vgName):
             raise errors.StorageLayoutParseError(storageLayoutName, errors.LVM_VG_NOT_FOUND(LvmUtil.vgName))
@@ -1328,16 +1383,30 @@ class HandyUtil:
         # get pv list
         pvList = []
         out = Util.cmdCall("lvm", "pvdisplay", "-c")
-        for m in re.finditer("(/dev/\\S+):%s:.*" % (LvmUtil.vgName), out, re.M):
+        for m in HandyUtil._lvmPvPattern.finditer(out):
             pvList.append(m.group(1))
 
         # find root lv
         out = Util.cmdCall("lvm", "lvdisplay", "-c")
-        if re.search("/dev/hdd/root:%s:.*" % (LvmUtil.vgName), out, re.M) is None:
+        if HandyUtil._lvmRootLvPattern.search(out) is None:
             raise errors.StorageLayoutParseError(storageLayoutName, errors.LVM_LV_NOT_FOUND(LvmUtil.rootLvDevPath))
 
+        HandyUtil._lvmPvListCache = (sig, tuple(pvList), time.monotonic())
         return pvList
 
+    @staticmethod
+    def lvmInvalidatePvListCache():
+        HandyUtil._lvmPvListCache = (None, None, 0.0)
+
+    @staticmethod
+    def _lvmGetStateSignature():
+        # lvm writes the metadata backup of a vg to a new file and renames it over the old one on every metadata change
+        try:
+            st = os.stat(os.path.join("/etc/lvm/backup", LvmUtil.vgName))
+            return (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
     @staticmethod
     def swapFileDetectAndNew(storageLayoutName, rootfs_mount_dir):
         fullfn = rootfs_mount_dir.rstrip("/") + Util.swapFilepath
@@ -1351,7 +1420,7 @@ class HandyUtil:
     @staticmethod
     def swapLvDetectAndNew(storageLayoutName):
         out = Util.cmdCall("lvm", "lvdisplay", "-c")
-        if re.search("/dev/hdd/swap:%s:.*" % (LvmUtil.vgName), out, re.M) is not None:
+        if HandyUtil._lvmSwapLvPattern.search(out) is not None:
             if Util.getBlkDevFsType(LvmUtil.swapLvDevPath) != Util.fsTypeSwap:
                 raise errors.StorageLayoutParseError(storageLayoutName, errors.SWAP_DEV_HAS_INVALID_FS_FLAG(LvmUtil.swapLvDevPath))
             return SwapLvmLv(True)
@@ -1395,3 +1464,14 @@ class HandyUtil:
             return espPartiList[0]
         else:
             raise errors.StorageLayoutParseError(storageLayoutName, "multiple ESP partitions found")
+
+
+_PARALLEL_MAX_WORKERS = 8
+
+
+def _parallelMap(func, argList):
+    # the thread pool is capped, a single item is processed in the calling thread
+    if len(argList) < 2:
+        return [func(x) for x in argList]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(argList), _PARALLEL_MAX_WORKERS)) as executor:
+        return list(executor.map(func, argList))
@@ -125,6 +125,10 @@ class StorageLayoutImpl(StorageLayout):
     def sync_esp(self, dst):
         pass
 
+    @EfiCacheGroup.proxy
+    def sync_all_esps(self):
+        pass
+
     @EfiCacheGroup.proxy
     def get_disk_list(self):
         pass
@@ -171,19 +175,20 @@ class StorageLayoutImpl(StorageLayout):
     def add_disk(self, disk):
         assert disk is not None
 
-        if disk not in Util.getDevPathListForFixedDisk():
+        if disk not in Util.getDevPathSetForFixedDisk():
             raise errors.StorageLayoutAddDiskError(disk, errors.NOT_DISK)
 
         if Util.isBlkDevSsdOrHdd(disk):
             if self._cg.boot_disk is not None:
                 self._mnt.umount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
-            self._cg.add_ssd(disk, "bcache")
-            self._bcache.add_cache(self._cg.get_ssd_cache_partition())
+            cacheParti = self._cg.add_ssd(disk, "bcache")
+            self._bcache.add_cache(cacheParti)
             self._mnt.mount_esp(self._cg.get_ssd_esp_partition())
             return True
         else:
-            self._cg.add_hdd(disk, "bcache")
-            self._bcache.add_backing(self._cg.get_ssd_cache_partition(), disk, self._cg.get_hdd_data_partition(disk))
+            dataParti = self._cg.add_hdd(disk, "bcache")
+            cacheParti = self._cg.get_ssd_cache_partition() if self._cg.get_ssd() is not None else None
+            self._bcache.add_backing(cacheParti, disk, dataParti)
             BtrfsUtil.addDiskToBtrfs(self._bcache.get_bcache_dev(disk), self._mnt.mount_point)
             if disk == self._cg.boot_disk:
                 self._mnt.mount_esp(self._cg.get_hdd_esp_partition(disk))
@@ -226,6 +231,7 @@ class StorageLayoutImpl(StorageLayout):
 
             # remove
             Util.cmdCall("btrfs", "device", "delete", self._bcache.get_bcache_dev(disk), self._mnt.mount_point)
+            Util.invalidateBlkDevInfoCache()
             self._bcache.remove_backing(disk)
             self._cg.remove_hdd(disk)
 
@@ -340,15 +346,16 @@ def create_and_mount(disk_list, mount_dir, kwargsDict):
 
     # create bcache
     bcache = Bcache()
-    for hdd in cg.get_hdd_list():
+    if True:
         # hdd partition 2: make them as backing device
-        bcache.add_backing(None, hdd, cg.get_hdd_data_partition(hdd))
+        bcache.add_backing_list(None, cg.get_hdd_list(), [cg.get_hdd_data_partition(x) for x in cg.get_hdd_list()])
     if cg.get_ssd() is not None:
         # ssd partition 3: make it as cache device
         bcache.add_cache(cg.get_ssd_cache_partition())
 
     # create btrfs
     Util.cmdCall("mkfs.btrfs", "-f", "-d", "single", "-m", "single", *bcache.get_all_bcache_dev_list())
+    Util.invalidateBlkDevInfoCache()
     SnapshotBtrfs.initializeFs(bcache.get_all_bcache_dev_list()[0], _devMntOptList(bcache))
 
     # return
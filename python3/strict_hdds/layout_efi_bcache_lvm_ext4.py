@@ -106,7 +106,7 @@ class StorageLayoutImpl(StorageLayout):
 
     def optimize_rootdev(self):
         LvmUtil.autoExtendLv(LvmUtil.rootLvDevPath)
-        Util.cmdExec("resize2fs", LvmUtil.rootLvDevPath)
+        Util.ext4ResizeFs(LvmUtil.rootLvDevPath, self._mnt.mount_point)
 
     @EfiCacheGroup.proxy
     def get_esp(self):
@@ -120,6 +120,10 @@ class StorageLayoutImpl(StorageLayout):
     def sync_esp(self, dst):
         pass
 
+    @EfiCacheGroup.proxy
+    def sync_all_esps(self):
+        pass
+
     @EfiCacheGroup.proxy
     def get_disk_list(self):
         pass
@@ -162,20 +166,23 @@ class StorageLayoutImpl(StorageLayout):
     def add_disk(self, disk):
         assert disk is not None
 
-        if disk not in Util.getDevPathListForFixedDisk():
+        if disk not in Util.getDevPathSetForFixedDisk():
             raise errors.StorageLayoutAddDiskError(disk, errors.NOT_DISK)
 
         if Util.isBlkDevSsdOrHdd(disk):
-            if self._cg.boot_disk is not None:
-                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
-            self._cg.add_ssd(disk, "bcache")
-            self._bcache.add_cache(self._cg.get_ssd_cache_partition())
+            bootDisk = self._cg.boot_disk
+            if bootDisk is not None:
+                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(bootDisk))
+            cacheParti = self._cg.add_ssd(disk, "bcache")
+            self._bcache.add_cache(cacheParti)
             self._mnt.mount_esp(self._cg.get_ssd_esp_partition())
             return True
         else:
-            self._cg.add_hdd(disk, "bcache")
-            self._bcache.add_backing(self._cg.get_ssd_cache_partition(), disk, self._cg.get_hdd_data_partition(disk))
+            dataParti = self._cg.add_hdd(disk, "bcache")
+            cacheParti = self._cg.get_ssd_cache_partition() if self._cg.get_ssd() is not None else None
+            self._bcache.add_backing(cacheParti, disk, dataParti)
             LvmUtil.addPvToVg(self._bcache.get_bcache_dev(disk), LvmUtil.vgName)
+            HandyUtil.lvmInvalidatePvListCache()
             if disk == self._cg.boot_disk:
                 self._mnt.mount_esp(self._cg.get_hdd_esp_partition(disk))
                 return True
@@ -197,8 +204,9 @@ class StorageLayoutImpl(StorageLayout):
             self._cg.remove_ssd()
 
             # boot disk change
-            if self._cg.boot_disk is not None:
-                self._mnt.mount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
+            bootDisk = self._cg.boot_disk
+            if bootDisk is not None:
+                self._mnt.mount_esp(self._cg.get_hdd_esp_partition(bootDisk))
                 return True
             else:
                 return False
@@ -210,23 +218,26 @@ class StorageLayoutImpl(StorageLayout):
 
             # boot disk change
             if disk == self._cg.boot_disk:
-                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
+                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(disk))
                 bChange = True
             else:
                 bChange = False
 
             # remove
-            rc, out = Util.cmdCallWithRetCode("lvm", "pvmove", self._bcache.get_bcache_dev(disk))
-            if rc != 5:
-                raise errors.StorageLayoutRemoveDiskError("failed")
-            Util.cmdCall("lvm", "vgreduce", LvmUtil.vgName, self._bcache.get_bcache_dev(disk))
+            try:
+                LvmUtil.removePvFromVg(self._bcache.get_bcache_dev(disk), LvmUtil.vgName)
+            except LvmUtil.Error as e:
+                raise errors.StorageLayoutRemoveDiskError(disk, str(e))
+            finally:
+                HandyUtil.lvmInvalidatePvListCache()
             self._bcache.remove_backing(disk)
             self._cg.remove_hdd(disk)
 
             # boot disk change
             if bChange:
-                assert self._cg.boot_disk is not None
-                self._mnt.mount_esp(self._cg.get_disk_esp_partition(self._cg.boot_disk))
+                bootDisk = self._cg.boot_disk
+                assert bootDisk is not None
+                self._mnt.mount_esp(self._cg.get_hdd_esp_partition(bootDisk))
                 return True
             else:
                 return False
@@ -314,9 +325,9 @@ def create_and_mount(disk_list, mount_dir, kwargsDict):
     HandyCg.checkAndAddDisks(cg, *Util.splitSsdAndHddFromFixedDiskDevPathList(disk_list), "bcache")
 
     bcache = Bcache()
-    for hdd in cg.get_hdd_list():
+    if True:
         # hdd partition 2: make them as backing device
-        bcache.add_backing(None, hdd, cg.get_hdd_data_partition(hdd))
+        bcache.add_backing_list(None, cg.get_hdd_list(), [cg.get_hdd_data_partition(x) for x in cg.get_hdd_list()])
     if cg.get_ssd() is not None:
         # ssd partition 3: make it as cache device
         bcache.add_cache(cg.get_ssd_cache_partition())
@@ -52,6 +52,7 @@ class StorageLayoutImpl(StorageLayout):
     def __init__(self):
         self._cg = None                     # EfiCacheGroup
         self._mnt = None                    # MountEfi
+        self._devRootfs = None              # cached value of dev_rootfs, reset when disk is added or removed
 
     @property
     def boot_mode(self):
@@ -59,12 +60,18 @@ class StorageLayoutImpl(StorageLayout):
 
     @property
     def dev_rootfs(self):
-        tlist = []
-        if self.get_ssd() is not None:
-            tlist.append(self.get_ssd_cache_partition())
-        for hdd in self.get_hdd_list():
-            tlist.append(self.get_hdd_data_partition(hdd))
-        return ":".join(tlist)
+        if self._devRootfs is None:
+            hddList = self.get_hdd_list()
+            if self.get_ssd() is None and len(hddList) == 1:
+                self._devRootfs = self.get_hdd_data_partition(hddList[0])             # single device, no join needed
+            else:
+                tlist = []
+                if self.get_ssd() is not None:
+                    tlist.append(self.get_ssd_cache_partition())
+                for hdd in hddList:
+                    tlist.append(self.get_hdd_data_partition(hdd))
+                self._devRootfs = ":".join(tlist)
+        return self._devRootfs
 
     @EfiCacheGroup.proxy
     @property
@@ -114,6 +121,10 @@ class StorageLayoutImpl(StorageLayout):
     def sync_esp(self, dst):
         pass
 
+    @EfiCacheGroup.proxy
+    def sync_all_esps(self):
+        pass
+
     @EfiCacheGroup.proxy
     def get_disk_list(self):
         pass
@@ -138,6 +149,10 @@ class StorageLayoutImpl(StorageLayout):
     def get_hdd_list(self):
         pass
 
+    @EfiCacheGroup.proxy
+    def get_hdd_set(self):
+        pass
+
     @EfiCacheGroup.proxy
     def get_hdd_esp_partition(self, disk):
         pass
@@ -153,19 +168,22 @@ class StorageLayoutImpl(StorageLayout):
     def add_disk(self, disk):
         assert disk is not None
 
-        if disk not in Util.getDevPathListForFixedDisk():
+        if disk not in Util.getDevPathSetForFixedDisk():
             raise errors.StorageLayoutAddDiskError(disk, errors.NOT_DISK)
 
         if Util.isBlkDevSsdOrHdd(disk):
-            if self._cg.boot_disk is not None:
-                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
-            self._cg.add_ssd(disk, Util.fsTypeBcachefs)
-            BcachefsUtil.addSsdToBcachefs(self._cg.get_ssd_cache_partition(), self._mnt.mount_point)
+            bootDisk = self._cg.boot_disk
+            if bootDisk is not None:
+                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(bootDisk))
+            cacheParti = self._cg.add_ssd(disk, Util.fsTypeBcachefs)
+            self._devRootfs = None
+            BcachefsUtil.addSsdToBcachefs(cacheParti, self._mnt.mount_point)
             self._mnt.mount_esp(self._cg.get_ssd_esp_partition())
             return True
         else:
-            self._cg.add_hdd(disk, Util.fsTypeBcachefs)
-            BcachefsUtil.addHddToBcachefs(self._cg.get_hdd_data_partition(disk), self._mnt.mount_point)
+            dataParti = self._cg.add_hdd(disk, Util.fsTypeBcachefs)
+            self._devRootfs = None
+            BcachefsUtil.addHddToBcachefs(dataParti, self._mnt.mount_point)
             if disk == self._cg.boot_disk:
                 self._mnt.mount_esp(self._cg.get_hdd_esp_partition(disk))
                 return True
@@ -175,32 +193,38 @@ class StorageLayoutImpl(StorageLayout):
     def remove_disk(self, disk):
         assert disk is not None
 
-        if disk == self._cg.get_ssd():
+        ssd = self._cg.get_ssd()
+        hddSet = self._cg.get_hdd_set()
+
+        if disk == ssd:
             # check if swap is in use
-            if self._cg.get_ssd_swap_partition() is not None:
-                if Util.isSwapFileOrPartitionBusy(self._cg.get_ssd_swap_partition()):
+            ssdSwapParti = self._cg.get_ssd_swap_partition()
+            if ssdSwapParti is not None:
+                if Util.isSwapFileOrPartitionBusy(ssdSwapParti):
                     raise errors.StorageLayoutRemoveDiskError(errors.SWAP_IS_IN_USE)
 
             # remove
             self._mnt.umount_esp(self._cg.get_ssd_esp_partition())
             BcachefsUtil.removeDevice(self._cg.get_ssd_cache_partition())
             self._cg.remove_ssd()
+            self._devRootfs = None
 
             # boot disk change
-            if self._cg.boot_disk is not None:
-                self._mnt.mount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
+            bootDisk = self._cg.boot_disk
+            if bootDisk is not None:
+                self._mnt.mount_esp(self._cg.get_hdd_esp_partition(bootDisk))
                 return True
             else:
                 return False
 
-        if disk in self._cg.get_hdd_list():
+        if disk in hddSet:
             # check for last hdd
-            if len(self._cg.get_hdd_list()) <= 1:
+            if len(hddSet) <= 1:
                 raise errors.StorageLayoutRemoveDiskError(errors.CAN_NOT_REMOVE_LAST_HDD)
 
             # boot disk change
             if disk == self._cg.boot_disk:
-                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(self._cg.boot_disk))
+                self._mnt.umount_esp(self._cg.get_hdd_esp_partition(disk))
                 bChange = True
             else:
                 bChange = False
@@ -208,11 +232,13 @@ class StorageLayoutImpl(StorageLayout):
             # remove
             BcachefsUtil.removeDevice(self._cg.get_hdd_data_partition(disk))
             self._cg.remove_hdd(disk)
+            self._devRootfs = None
 
             # boot disk change
             if bChange:
-                assert self._cg.boot_disk is not None
-                self._mnt.mount_esp(self._cg.get_disk_esp_partition(self._cg.boot_disk))
+                bootDisk = self._cg.boot_disk
+                assert bootDisk is not None
+                self._mnt.mount_esp(self._cg.get_hdd_esp_partition(bootDisk))
                 return True
             else:
                 return False
@@ -242,7 +268,7 @@ def parse(boot_dev, root_dev, mount_dir):
         raise errors.StorageLayoutParseError(StorageLayoutImpl.name, errors.BOOT_DEV_NOT_EXIST)
     for rootDev in rootDevList:
         if Util.getBlkDevFsType(rootDev) != Util.fsTypeBcachefs:
-            raise errors.StorageLayoutParseError(StorageLayoutImpl.name, "file system of root partition %s is not %s" % (Util.fsTypeBcachefs))
+            raise errors.StorageLayoutParseError(StorageLayoutImpl.name, errors.ROOT_PARTITION_FS_SHOULD_BE(Util.fsTypeBcachefs))
 
     # ssd, hdd_list, boot_disk
     ssd, hddList = HandyCg.checkAndGetSsdAndHddList(*BcachefsUtil.getSlaveSsdDevPatListAndHddDevPathList(rootDevList))
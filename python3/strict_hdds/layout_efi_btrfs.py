@@ -103,6 +103,10 @@ class StorageLayoutImpl(StorageLayout):
     def sync_esp(self, dst):
         pass
 
+    @EfiMultiDisk.proxy
+    def sync_all_esps(self):
+        pass
+
     @EfiMultiDisk.proxy
     def get_disk_list(self):
         pass
@@ -122,7 +126,7 @@ class StorageLayoutImpl(StorageLayout):
     def add_disk(self, disk):
         assert disk is not None
 
-        if disk not in Util.getDevPathListForFixedDisk():
+        if disk not in Util.getDevPathSetForFixedDisk():
             raise errors.StorageLayoutAddDiskError(disk, errors.NOT_DISK)
 
         # add
@@ -154,6 +158,7 @@ class StorageLayoutImpl(StorageLayout):
 
         # hdd partition 2: remove from btrfs and bcache
         Util.cmdCall("btrfs", "device", "delete", self._md.get_disk_data_partition(disk), self._mnt.mount_point)
+        Util.invalidateBlkDevInfoCache()
 
         # remove
         self._md.remove_disk(disk)
@@ -258,6 +263,7 @@ def create_and_mount(disk_list, mount_dir, kwargsDict):
     # create and mount
     partiList = [md.get_disk_data_partition(x) for x in md.get_disk_list()]
     Util.cmdCall("mkfs.btrfs", "-f", "-d", "single", "-m", "single", *partiList)
+    Util.invalidateBlkDevInfoCache()
     SnapshotBtrfs.initializeFs(partiList[0], ["device=%s" % (x) for x in partiList])
 
     # return
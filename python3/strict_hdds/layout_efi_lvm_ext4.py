@@ -96,7 +96,7 @@ class StorageLayoutImpl(StorageLayout):
 
     def optimize_rootdev(self):
         LvmUtil.autoExtendLv(LvmUtil.rootLvDevPath)
-        Util.cmdExec("resize2fs", LvmUtil.rootLvDevPath)
+        Util.ext4ResizeFs(LvmUtil.rootLvDevPath, self._mnt.mount_point)
 
     @EfiMultiDisk.proxy
     def get_esp(self):
@@ -110,6 +110,10 @@ class StorageLayoutImpl(StorageLayout):
     def sync_esp(self, dst):
         pass
 
+    @EfiMultiDisk.proxy
+    def sync_all_esps(self):
+        pass
+
     @EfiMultiDisk.proxy
     def get_disk_list(self):
         pass
@@ -129,7 +133,7 @@ class StorageLayoutImpl(StorageLayout):
     def add_disk(self, disk):
         assert disk is not None
 
-        if disk not in Util.getDevPathListForFixedDisk():
+        if disk not in Util.getDevPathSetForFixedDisk():
             raise errors.StorageLayoutAddDiskError(disk, errors.NOT_DISK)
 
         # add
@@ -137,6 +141,7 @@ class StorageLayoutImpl(StorageLayout):
 
         # create lvm physical volume on partition2 and add it to volume group
         LvmUtil.addPvToVg(self._md.get_disk_data_partition(disk), LvmUtil.vgName)
+        HandyUtil.lvmInvalidatePvListCache()
 
         # boot disk change
         if disk == self._md.boot_disk:
@@ -160,10 +165,12 @@ class StorageLayoutImpl(StorageLayout):
 
         # hdd partition 2: remove from volume group
         parti = self._md.get_disk_data_partition(disk)
-        rc, out = Util.cmdCallWithRetCode("lvm", "pvmove", parti)
-        if rc != 5:
-            raise errors.StorageLayoutRemoveDiskError("failed")
-        Util.cmdCall("lvm", "vgreduce", LvmUtil.vgName, parti)
+        try:
+            LvmUtil.removePvFromVg(parti, LvmUtil.vgName)
+        except LvmUtil.Error as e:
+            raise errors.StorageLayoutRemoveDiskError(disk, str(e))
+        finally:
+            HandyUtil.lvmInvalidatePvListCache()
 
         # remove
         self._md.remove_disk(disk)
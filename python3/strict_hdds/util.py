@@ -23,11 +23,14 @@
 
 import os
 import re
+import errno
+import fcntl
 import uuid
 import time
 import stat
+import signal
 import psutil
-import crcmod
+import crcmod.predefined
 import parted
 import struct
 import pathlib
@@ -60,13 +63,27 @@ class Util:
 
     checkItemBasic = "basic"
 
+    zeroBuf = bytes(32 * 512)                 # shared zero-filled buffer, slice it by memoryview instead of allocating bytearray
+
+    _fixedDiskSetCache = (None, 0.0)          # (frozenset, timestamp)
+    _blkDevFsTypeCache = dict()               # {devPath: fsType}
+    _blkDevBlkidInfoCache = dict()            # {devPath: {KEY: value}}
+    _rotationalCache = dict()                 # {devPath: bIsSsd}
+
+    _bcachefsFileOutputPattern = re.compile("^bcachefs, UUID=")
+    _dfOutputPattern = re.compile("^\\S+ +(\\d+)M +(\\d+)M +\\d+M", re.M)
+    _partiSizePattern = re.compile("([0-9]+)(MiB|GiB|TiB)")
+    _usbDevLinkPattern = re.compile("/usb[0-9]+/")
+
+    # return codes of a callee terminated by SIGTERM, SIGINT or SIGHUP, reported by subprocess (-N) or by a shell (128+N)
+    # other signals (SIGPIPE for example) are not sent to the process group by the user, no need to wait for them
+    _termSignalRetCodes = frozenset([-signal.SIGTERM, -signal.SIGINT, -signal.SIGHUP,
+                                     128 + signal.SIGTERM, 128 + signal.SIGINT, 128 + signal.SIGHUP])
+
     @staticmethod
     def keyValueListToDict(keyList, valueList):
         assert len(keyList) == len(valueList)
-        ret = dict()
-        for i in range(0, len(keyList)):
-            ret[keyList[i]] = valueList[i]
-        return ret
+        return dict(zip(keyList, valueList))
 
     @staticmethod
     def anyIn(list1, list2):
@@ -94,16 +111,15 @@ class Util:
 
     @staticmethod
     def getPhysicalMemorySizeInGb():
-        with open("/proc/meminfo", "r") as f:
-            # We return memory size in GB.
-            # Since the memory size shown in /proc/meminfo is always a
-            # little less than the real size because various sort of
-            # reservation, so we do a "+1"
-            m = re.search("^MemTotal:\\s+(\\d+)", f.read())
-            return int(m.group(1)) // 1024 // 1024 + 1
+        # We return memory size in GB.
+        # Since the memory size reported by the kernel (the same value as
+        # MemTotal in /proc/meminfo) is always a little less than the real
+        # size because various sort of reservation, so we do a "+1"
+        memSize = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        return memSize // 1024 // 1024 // 1024 + 1
 
     @staticmethod
-    def cmdCall(cmd, *kargs):
+    def cmdCall(cmd, *kargs, input=None):
         # call command to execute backstage job
         #
         # scenario 1, process group receives SIGTERM, SIGINT and SIGHUP:
@@ -114,33 +130,35 @@ class Util:
         #   * callee must auto-terminate, and cause no side-effect, after caller is terminated
         # scenario 3, callee receives SIGTERM, SIGINT, SIGHUP:
         #   * caller detects child-process failure and do appopriate treatment
+        #
+        # input, if not None, is a string fed to the callee's standard input, same as subprocess.run()
 
         ret = subprocess.run([cmd] + list(kargs),
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                             universal_newlines=True)
-        if ret.returncode > 128:
+                             input=(input.encode("utf-8") if input is not None else None),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = ret.stdout.decode("utf-8", "replace")               # decode once, no universal newlines translation
+        if ret.returncode in Util._termSignalRetCodes:
             # for scenario 1, caller's signal handler has the oppotunity to get executed during sleep
             time.sleep(1.0)
         if ret.returncode != 0:
-            print(ret.stdout)
+            print(out)
             ret.check_returncode()
-        return ret.stdout.rstrip()
+        return out.rstrip()
 
     @staticmethod
     def cmdCallWithRetCode(cmd, *kargs):
         ret = subprocess.run([cmd] + list(kargs),
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                             universal_newlines=True)
-        if ret.returncode > 128:
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = ret.stdout.decode("utf-8", "replace")               # same decoding as cmdCall()
+        if ret.returncode in Util._termSignalRetCodes:
             time.sleep(1.0)
-        return (ret.returncode, ret.stdout.rstrip())
+        return (ret.returncode, out.rstrip())
 
     @staticmethod
     def cmdCallTestSuccess(cmd, *kargs):
         ret = subprocess.run([cmd] + list(kargs),
-                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                             universal_newlines=True)
-        if ret.returncode > 128:
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if ret.returncode in Util._termSignalRetCodes:
             time.sleep(1.0)
         return (ret.returncode == 0)
 
@@ -161,22 +179,24 @@ class Util:
 
         # FIXME, the above condition is not met, FmUtil.shellExec has the same problem
 
-        ret = subprocess.run([cmd] + list(kargs), universal_newlines=True)
-        if ret.returncode > 128:
+        ret = subprocess.run([cmd] + list(kargs))
+        if ret.returncode in Util._termSignalRetCodes:
             time.sleep(1.0)
         ret.check_returncode()
 
     @staticmethod
     def shellExec(cmd):
-        ret = subprocess.run(cmd, shell=True, universal_newlines=True)
-        if ret.returncode > 128:
+        ret = subprocess.run(cmd, shell=True)
+        if ret.returncode in Util._termSignalRetCodes:
             time.sleep(1.0)
         ret.check_returncode()
 
     @staticmethod
     def wipeHarddisk(devpath):
         with open(devpath, 'wb') as f:
-            f.write(bytearray(1024))
+            f.write(memoryview(Util.zeroBuf)[:1024])
+        Util.invalidateBlkDevInfoCache()
+        Util._rotationalCache.pop(devpath, None)        # this disk is leaving us
 
     @staticmethod
     def isHarddiskClean(devpath):
@@ -185,54 +205,90 @@ class Util:
 
     @staticmethod
     def isBlkDevSsdOrHdd(devPath):
-        bn = os.path.basename(devPath)
-        with open("/sys/block/%s/queue/rotational" % (bn), "r") as f:
-            buf = f.read().strip("\n")
-            if buf == "1":
-                return False
-        return True
+        ret = Util._rotationalCache.get(devPath)
+        if ret is None:
+            bn = os.path.basename(os.path.realpath(devPath))             # devPath may be a symlink in /dev/disk/*
+            with open("/sys/block/%s/queue/rotational" % (bn), "rb") as f:
+                ret = (f.read(1) == b"0")
+            Util._rotationalCache[devPath] = ret
+        return ret
 
     @staticmethod
     def getBlkDevSize(devPath):
-        out = Util.cmdCall("blockdev", "--getsz", devPath)
-        return int(out) * 512        # unit is byte
+        # read sysfs instead of running blockdev, devPath may be a symlink, /dev/hdd/swap for example
+        bn = os.path.basename(os.path.realpath(devPath))
+        with open("/sys/class/block/%s/size" % (bn), "rb") as f:
+            return int(f.read()) * 512        # sysfs unit is always 512-byte sector, return value unit is byte
+
+    @staticmethod
+    def getBlkDevLogicalBlockSize(devPath):
+        sysPath = os.path.realpath(os.path.join("/sys/class/block", os.path.basename(os.path.realpath(devPath))))
+        if not os.path.exists(os.path.join(sysPath, "queue")):
+            sysPath = os.path.dirname(sysPath)                  # partition, queue attributes belong to the parent disk
+        with open(os.path.join(sysPath, "queue", "logical_block_size"), "rb") as f:
+            return int(f.read())
 
     @staticmethod
     def getBlkDevPartitionTableType(devPath):
         if not PartiUtil.isDiskOrParti(devPath):
             devPath = PartiUtil.partiToDisk(devPath)
 
-        ret = Util.cmdCall("blkid", "-o", "export", devPath)
-        m = re.search("^PTTYPE=(\\S+)$", ret, re.M)
-        if m is not None:
-            if m.group(1) == "gpt":
+        ret = Util.getBlkDevBlkidInfo(devPath).get("PTTYPE")
+        if ret is not None:
+            if ret == "gpt":
                 return Util.diskPartTableGpt
-            elif m.group(1) == "dos":
+            elif ret == "dos":
                 return Util.diskPartTableMbr
             else:
-                return m.group(1)
+                return ret
         else:
             return ""
 
     @staticmethod
     def getBlkDevFsType(devPath):
+        # file system type is cached, it is invalidated by invalidateBlkDevInfoCache() when we write to a harddisk
+        ret = Util._blkDevFsTypeCache.get(devPath)
+        if ret is None:
+            ret = Util._getBlkDevFsType(devPath)
+            Util._blkDevFsTypeCache[devPath] = ret
+        return ret
+
+    @staticmethod
+    def getBlkDevBlkidInfo(devPath):
+        # returns {KEY: value} parsed from one "blkid -o export" call, cached together with file system type
+        ret = Util._blkDevBlkidInfoCache.get(devPath)
+        if ret is None:
+            ret = dict()
+            for line in Util.cmdCall("blkid", "-o", "export", devPath).split("\n"):
+                k, sep, v = line.partition("=")
+                if sep != "":
+                    ret[k] = v
+            Util._blkDevBlkidInfoCache[devPath] = ret
+        return ret
+
+    @staticmethod
+    def invalidateBlkDevInfoCache():
+        Util._blkDevFsTypeCache.clear()
+        Util._blkDevBlkidInfoCache.clear()
+
+    @staticmethod
+    def _getBlkDevFsType(devPath):
         # FIXME: blkid doesn't support bcachefs yet, use file instead
         ret = Util.cmdCall("file", "-sb", devPath)
-        if re.search("^bcachefs, UUID=", ret) is not None:
+        if Util._bcachefsFileOutputPattern.search(ret) is not None:
             return "bcachefs"
 
         # use blkid to get fstype
-        ret = Util.cmdCall("blkid", "-o", "export", devPath)
-        m = re.search("^TYPE=(\\S+)$", ret, re.M)
-        if m is not None:
-            return m.group(1).lower()
+        ret = Util.getBlkDevBlkidInfo(devPath).get("TYPE")
+        if ret is not None:
+            return ret.lower()
         else:
             return ""
 
     @staticmethod
     def getBlkDevCapacity(devPath):
         ret = Util.cmdCall("df", "-BM", devPath)
-        m = re.search("%s +(\\d+)M +(\\d+)M +\\d+M", ret, re.M)
+        m = Util._dfOutputPattern.search(ret)              # the first line is the header
         total = int(m.group(1))
         used = int(m.group(2))
         return (total, used)        # unit: MB
@@ -258,11 +314,28 @@ class Util:
                 with TmpMount(devPath2) as mp2:
                     Util.shellExec(cmd % (mp1.mountpoint, mp2.mountpoint))
 
+    @staticmethod
+    def ext4ResizeFs(devPath, mountPoint):
+        # do online resize by EXT4_IOC_RESIZE_FS directly, so that no resize2fs process is needed
+        EXT4_IOC_RESIZE_FS = 0x40086610            # _IOW('f', 16, __u64)
+
+        blockCount = Util.getBlkDevSize(devPath) // os.statvfs(mountPoint).f_bsize
+        fd = os.open(mountPoint, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            fcntl.ioctl(fd, EXT4_IOC_RESIZE_FS, struct.pack("Q", blockCount))
+        except OSError as e:
+            if e.errno not in [errno.ENOTTY, errno.EOPNOTSUPP]:
+                raise
+            Util.cmdExec("resize2fs", devPath)
+        finally:
+            os.close(fd)
+
     @staticmethod
     def createSwapFile(path):
         Util.cmdCall("dd", "if=/dev/zero", "of=%s" % (path), "bs=%d" % (1024 * 1024), "count=%d" % (Util.getSwapSizeInGb() * 1024))
         Util.cmdCall("chmod", "600", path)
         Util.cmdCall("mkswap", "-f", path)
+        Util.invalidateBlkDevInfoCache()
 
     @staticmethod
     def isSwapFileOrPartitionBusy(path):
@@ -294,118 +367,58 @@ class Util:
 
     @staticmethod
     def initializeDisk(devPath, partitionTableType, partitionInfoList):
+        script = Util.partitionInfoListToSfdiskScript(partitionTableType, partitionInfoList)
+
+        # write to disk, erase old signatures in the new partitions, notify kernel, block until udev picks up this change
+        Util.cmdCall("sfdisk", "--quiet", "--wipe-partitions", "always", devPath, input=script)
+        Util.cmdCall("udevadm", "settle")
+        Util.invalidateBlkDevInfoCache()
+
+    @staticmethod
+    def partitionInfoListToSfdiskScript(partitionTableType, partitionInfoList):
         assert partitionTableType in ["mbr", "gpt"]
         assert len(partitionInfoList) >= 1
 
+        # sfdisk partition type for each pType, "L" / "U" / "V" are sfdisk shortcuts for known types
         if partitionTableType == "mbr":
-            partitionTableType = "msdos"
-
-        def _getFreeRegion(disk):
-            region = None
-            for r in disk.getFreeSpaceRegions():
-                if r.length <= disk.device.optimumAlignment.grainSize:
-                    continue                                                # ignore alignment gaps
-                if region is not None:
-                    assert False                                            # there should be only one free region
-                region = r
-            return region
-
-        def _addPartition(disk, pType, pStart, pEnd):
-            region = parted.Geometry(device=disk.device, start=pStart, end=pEnd)
-            if pType == "":
-                partition = parted.Partition(disk=disk, type=parted.PARTITION_NORMAL, geometry=region)
-            elif pType == "esp":
-                assert partitionTableType == "gpt"
-                partition = parted.Partition(disk=disk,
-                                             type=parted.PARTITION_NORMAL,
-                                             fs=parted.FileSystem(type="fat32", geometry=region),
-                                             geometry=region)
-                partition.setFlag(parted.PARTITION_BOOT)
-            elif pType in ["bcache", "bcachefs"]:
-                assert partitionTableType == "gpt"
-                partition = parted.Partition(disk=disk, type=parted.PARTITION_NORMAL, geometry=region)
-            elif pType == "swap":
-                partition = parted.Partition(disk=disk, type=parted.PARTITION_NORMAL, geometry=region)
-                if partitionTableType == "mbr":
-                    partition.setFlag(parted.PARTITION_SWAP)
-                elif partitionTableType == "gpt":
-                    pass            # don't know why, it says gpt partition has no way to setFlag(SWAP)
-                else:
-                    assert False
-            elif pType == "lvm":
-                partition = parted.Partition(disk=disk, type=parted.PARTITION_NORMAL, geometry=region)
-                partition.setFlag(parted.PARTITION_LVM)
-            elif pType == "vfat":
-                partition = parted.Partition(disk=disk,
-                                             type=parted.PARTITION_NORMAL,
-                                             fs=parted.FileSystem(type="fat32", geometry=region),
-                                             geometry=region)
-            elif pType in ["ext4", "btrfs"]:
-                partition = parted.Partition(disk=disk,
-                                             type=parted.PARTITION_NORMAL,
-                                             fs=parted.FileSystem(type=pType, geometry=region),
-                                             geometry=region)
-            else:
-                assert False
-            disk.addPartition(partition=partition,
-                              constraint=disk.device.optimalAlignedConstraint)
-
-        def _erasePartitionSignature(devPath, pStart, pEnd):
-            # fixme: this implementation is very limited
-            with open(devPath, "wb") as f:
-                f.seek(pStart * 512)
-                if pEnd - pStart + 1 < 32:
-                    f.write(bytearray((pEnd - pStart + 1) * 512))
-                else:
-                    f.write(bytearray(32 * 512))
-
-        # partitionInfoList => preList & postList
-        preList = None
-        postList = None
+            label = "dos"
+            typeDict = {
+                "": "83",
+                "swap": "82",
+                "lvm": "8e",
+                "vfat": "0c",
+                "ext4": "83",
+                "btrfs": "83",
+            }
+        elif partitionTableType == "gpt":
+            label = "gpt"
+            typeDict = {
+                "": "L",
+                "esp": "U",
+                "bcache": "L",
+                "bcachefs": "L",
+                "swap": "L",                            # libparted had no way to set the swap type on gpt, keep its result
+                "lvm": "V",
+                "vfat": "EBD0A0A2-B9E5-4433-87C0-68B6B72699C7",         # Microsoft basic data
+                "ext4": "L",
+                "btrfs": "L",
+            }
+        else:
+            assert False
+
+        # partitionInfoList => sfdisk script, only the last partition can use all the remaining space
+        # sfdisk builds the whole partition table in one run, partitions are aligned to 1MiB by default
+        script = "label: %s\n" % (label)
         for i in range(0, len(partitionInfoList)):
             pSize, pType = partitionInfoList[i]
+            assert pType in typeDict
             if pSize == "*":
-                assert preList is None
-                preList = partitionInfoList[:i]
-                postList = partitionInfoList[i:]
-        if preList is None:
-            preList = partitionInfoList
-            postList = []
-
-        # delete all partitions
-        disk = parted.freshDisk(parted.getDevice(devPath), partitionTableType)
-
-        # process preList
-        for pSize, pType in preList:
-            region = _getFreeRegion(disk)
-            constraint = parted.Constraint(maxGeom=region).intersect(disk.device.optimalAlignedConstraint)
-            pStart = constraint.startAlign.alignUp(region, region.start)
-            pEnd = constraint.endAlign.alignDown(region, region.end)
-
-            m = re.fullmatch("([0-9]+)(MiB|GiB|TiB)", pSize)
-            assert m is not None
-            sectorNum = parted.sizeToSectors(int(m.group(1)), m.group(2), disk.device.sectorSize)
-            if pEnd < pStart + sectorNum - 1:
-                raise Exception("not enough space")
-
-            _addPartition(disk, pType, pStart, pStart + sectorNum - 1)
-            _erasePartitionSignature(devPath, pStart, pEnd)
-
-        # process postList
-        for pSize, pType in postList:
-            region = _getFreeRegion(disk)
-            constraint = parted.Constraint(maxGeom=region).intersect(disk.device.optimalAlignedConstraint)
-            pStart = constraint.startAlign.alignUp(region, region.start)
-            pEnd = constraint.endAlign.alignDown(region, region.end)
-
-            if pSize == "*":
-                _addPartition(disk, pType, pStart, pEnd)
-                _erasePartitionSignature(devPath, pStart, pEnd)
+                assert i == len(partitionInfoList) - 1
+                script += "type=%s\n" % (typeDict[pType])
             else:
-                assert False
-
-        # write to disk, notify kernel, block until kernel to pick up this change
-        disk.commit()
+                assert Util._partiSizePattern.fullmatch(pSize) is not None
+                script += "size=%s, type=%s\n" % (pSize, typeDict[pType])
+        return script
 
     @staticmethod
     def toggleEspPartition(devPath, espOrRegular):
@@ -420,34 +433,51 @@ class Util:
         else:
             partObj.unsetFlag(parted.PARTITION_BOOT)
         diskObj.commit()
+        Util.invalidateBlkDevInfoCache()
 
     @staticmethod
     def isBufferAllZero(buf):
-        for b in buf:
-            if b != 0:
-                return False
-        return True
+        # any() runs in C, no byte-by-byte python loop
+        return not any(buf)
 
     @staticmethod
     def getDevPathListForFixedDisk():
+        # walk /sys/block directly instead of running lsblk
+        # only block devices backed by hardware have "device" link, so loop, dm, md, bcache, zram are excluded
+        # entries in /sys/block are symlinks to the full device path, one readlink() tells us if it sits on an usb bus
         ret = []
-        for line in Util.cmdCall("lsblk", "-o", "NAME,TYPE", "-n").split("\n"):
-            m = re.fullmatch("(\\S+)\\s+(\\S+)", line)
-            if m is None:
-                continue
-            if m.group(2) != "disk":
-                continue
-            if re.search("/usb[0-9]+/", os.path.realpath("/sys/block/%s/device" % (m.group(1)))) is not None:      # USB device
-                continue
-            ret.append("/dev/" + m.group(1))
+        with os.scandir("/sys/block") as it:
+            for entry in sorted(it, key=lambda x: x.name):
+                devLink = os.path.join(entry.path, "device")
+                if not os.path.exists(devLink):
+                    continue
+                try:
+                    with open(os.path.join(devLink, "type"), "rb") as f:
+                        if f.read().strip() != b"0":                    # SCSI device type which is not TYPE_DISK, cdrom for example
+                            continue
+                except FileNotFoundError:
+                    pass                                                # non-SCSI device, nvme and virtio for example
+                if Util._usbDevLinkPattern.search(os.readlink(entry.path)) is not None:        # USB device
+                    continue
+                ret.append("/dev/" + entry.name)
         return ret
 
+    @staticmethod
+    def getDevPathSetForFixedDisk():
+        # enumerating harddisks is expensive, the result is cached for a short time
+        diskSet, ts = Util._fixedDiskSetCache
+        if diskSet is None or time.monotonic() - ts >= 2.0:
+            diskSet = frozenset(Util.getDevPathListForFixedDisk())
+            Util._fixedDiskSetCache = (diskSet, time.monotonic())
+        return diskSet
+
     @staticmethod
     def getDevPathListForFixedSsdAndHdd():
         return Util.getSsdAndHddListFromFixedDiskList(Util.getDevPathListForFixedDisk())
 
     @staticmethod
     def splitSsdAndHddFromFixedDiskDevPathList(diskList):
+        # classifies all the disks in one pass, the result is kept for later isBlkDevSsdOrHdd() calls
         ssdList = []
         hddList = []
         for devpath in diskList:
@@ -468,40 +498,24 @@ class Util:
 
 class PartiUtil:
 
+    # group 1, 2: disk and partition id of sd, xvd, vd devices
+    # group 3, 4: disk and partition id of nvme devices
+    _devPathPattern = re.compile("(/dev/(?:sd|xvd|vd)[a-z])([0-9]+)?|(/dev/nvme[0-9]+n[0-9]+)(?:p([0-9]+))?")
+
     @staticmethod
     def isDiskOrParti(devPath):
-        if re.fullmatch("/dev/sd[a-z]", devPath) is not None:
-            return True
-        if re.fullmatch("(/dev/sd[a-z])([0-9]+)", devPath) is not None:
-            return False
-        if re.fullmatch("/dev/xvd[a-z]", devPath) is not None:
-            return True
-        if re.fullmatch("(/dev/xvd[a-z])([0-9]+)", devPath) is not None:
-            return False
-        if re.fullmatch("/dev/vd[a-z]", devPath) is not None:
-            return True
-        if re.fullmatch("(/dev/vd[a-z])([0-9]+)", devPath) is not None:
-            return False
-        if re.fullmatch("/dev/nvme[0-9]+n[0-9]+", devPath) is not None:
-            return True
-        if re.fullmatch("(/dev/nvme[0-9]+n[0-9]+)p([0-9]+)", devPath) is not None:
-            return False
-        assert False
+        m = PartiUtil._devPathPattern.fullmatch(devPath)
+        assert m is not None
+        return m.group(2) is None and m.group(4) is None
 
     @staticmethod
     def partiToDiskAndPartiId(partitionDevPath):
-        m = re.fullmatch("(/dev/sd[a-z])([0-9]+)", partitionDevPath)
-        if m is not None:
-            return (m.group(1), int(m.group(2)))
-        m = re.fullmatch("(/dev/xvd[a-z])([0-9]+)", partitionDevPath)
-        if m is not None:
-            return (m.group(1), int(m.group(2)))
-        m = re.fullmatch("(/dev/vd[a-z])([0-9]+)", partitionDevPath)
-        if m is not None:
-            return (m.group(1), int(m.group(2)))
-        m = re.fullmatch("(/dev/nvme[0-9]+n[0-9]+)p([0-9]+)", partitionDevPath)
-        if m is not None:
+        m = PartiUtil._devPathPattern.fullmatch(partitionDevPath)
+        assert m is not None
+        if m.group(2) is not None:
             return (m.group(1), int(m.group(2)))
+        if m.group(4) is not None:
+            return (m.group(3), int(m.group(4)))
         assert False
 
     @staticmethod
@@ -510,19 +524,12 @@ class PartiUtil:
 
     @staticmethod
     def diskToParti(diskDevPath, partitionId):
-        m = re.fullmatch("/dev/sd[a-z]", diskDevPath)
-        if m is not None:
-            return diskDevPath + str(partitionId)
-        m = re.fullmatch("/dev/xvd[a-z]", diskDevPath)
-        if m is not None:
-            return diskDevPath + str(partitionId)
-        m = re.fullmatch("/dev/vd[a-z]", diskDevPath)
-        if m is not None:
-            return diskDevPath + str(partitionId)
-        m = re.fullmatch("/dev/nvme[0-9]+n[0-9]+", diskDevPath)
-        if m is not None:
+        # the caller must give a disk, a string prefix test is enough to decide the naming scheme
+        assert PartiUtil.isDiskOrParti(diskDevPath)
+        if diskDevPath.startswith("/dev/nvme"):
             return diskDevPath + "p" + str(partitionId)
-        assert False
+        else:
+            return diskDevPath + str(partitionId)
 
     @staticmethod
     def diskHasParti(diskDevPath, partitionId):
@@ -558,6 +565,68 @@ class MbrUtil:
 
 class GptUtil:
 
+    # structs are compiled once, they are used by isEspPartition()
+
+    # struct mbr_partition_record {
+    #     uint8_t  boot_indicator;
+    #     uint8_t  start_head;
+    #     uint8_t  start_sector;
+    #     uint8_t  start_track;
+    #     uint8_t  os_type;
+    #     uint8_t  end_head;
+    #     uint8_t  end_sector;
+    #     uint8_t  end_track;
+    #     uint32_t starting_lba;
+    #     uint32_t size_in_lba;
+    # };
+    _mbrPartitionRecordStruct = struct.Struct("8BII")
+    assert _mbrPartitionRecordStruct.size == 16
+
+    # struct mbr_header {
+    #     uint8_t                     boot_code[440];
+    #     uint32_t                    unique_mbr_signature;
+    #     uint16_t                    unknown;
+    #     struct mbr_partition_record partition_record[4];
+    #     uint16_t                    signature;
+    # };
+    _mbrHeaderStruct = struct.Struct("440sIH%dsH" % (_mbrPartitionRecordStruct.size * 4))
+    assert _mbrHeaderStruct.size == 512
+
+    # struct gpt_entry {
+    #     struct gpt_guid type;
+    #     struct gpt_guid partition_guid;
+    #     uint64_t        lba_start;
+    #     uint64_t        lba_end;
+    #     uint64_t        attrs;
+    #     uint16_t        name[GPT_PART_NAME_LEN];
+    # };
+    _gptEntryStruct = struct.Struct("16s16sQQQ36H")
+    assert _gptEntryStruct.size == 128
+
+    # struct gpt_header {
+    #     uint64_t            signature;
+    #     uint32_t            revision;
+    #     uint32_t            size;
+    #     uint32_t            crc32;
+    #     uint32_t            reserved1;
+    #     uint64_t            my_lba;
+    #     uint64_t            alternative_lba;
+    #     uint64_t            first_usable_lba;
+    #     uint64_t            last_usable_lba;
+    #     struct gpt_guid     disk_guid;
+    #     uint64_t            partition_entry_lba;
+    #     uint32_t            npartition_entries;
+    #     uint32_t            sizeof_partition_entry;
+    #     uint32_t            partition_entry_array_crc32;
+    #     uint8_t             reserved2[512 - 92];
+    # };
+    _gptHeaderStruct = struct.Struct("QIIIIQQQQ16sQIII420s")
+    assert _gptHeaderStruct.size == 512
+
+    _headReadSize = 16 * 512                # protective MBR, GPT header and partition entries 1-56 when they start at LBA 2
+
+    _espPartitionTypeGuid = uuid.UUID("C12A7328-F81F-11D2-BA4B-00A0C93EC93B").bytes_le       # same as newGuid() returns
+
     @staticmethod
     def newGuid(guidStr):
         assert len(guidStr) == 36
@@ -571,124 +640,90 @@ class GptUtil:
         #     uint8_t    clock_seq_low;
         #     uint8_t    node[6];
         # };
-        gptGuidFmt = "IHHBB6s"
-        assert struct.calcsize(gptGuidFmt) == 16
-
-        guidStr = guidStr.replace("-", "")
-
-        # really obscure behavior of python3
-        # see http://stackoverflow.com/questions/1463306/how-does-exec-work-with-locals
-        ldict = {}
-        exec("n1 = 0x" + guidStr[0:8], globals(), ldict)
-        exec("n2 = 0x" + guidStr[8:12], globals(), ldict)
-        exec("n3 = 0x" + guidStr[12:16], globals(), ldict)
-        exec("n4 = 0x" + guidStr[16:18], globals(), ldict)
-        exec("n5 = 0x" + guidStr[18:20], globals(), ldict)
-        exec("n6 = bytearray()", globals(), ldict)
-        for i in range(0, 6):
-            exec("n6.append(0x" + guidStr[20 + i * 2:20 + (i + 1) * 2] + ")", globals(), ldict)
-
-        return struct.pack(gptGuidFmt, ldict["n1"], ldict["n2"], ldict["n3"], ldict["n4"], ldict["n5"], ldict["n6"])
+        # this is exactly the mixed-endian layout of uuid.UUID.bytes_le
+        return uuid.UUID(guidStr).bytes_le
 
     @staticmethod
     def isEspPartition(devPath):
-        # struct mbr_partition_record {
-        #     uint8_t  boot_indicator;
-        #     uint8_t  start_head;
-        #     uint8_t  start_sector;
-        #     uint8_t  start_track;
-        #     uint8_t  os_type;
-        #     uint8_t  end_head;
-        #     uint8_t  end_sector;
-        #     uint8_t  end_track;
-        #     uint32_t starting_lba;
-        #     uint32_t size_in_lba;
-        # };
-        mbrPartitionRecordFmt = "8BII"
-        assert struct.calcsize(mbrPartitionRecordFmt) == 16
-
-        # struct mbr_header {
-        #     uint8_t                     boot_code[440];
-        #     uint32_t                    unique_mbr_signature;
-        #     uint16_t                    unknown;
-        #     struct mbr_partition_record partition_record[4];
-        #     uint16_t                    signature;
-        # };
-        mbrHeaderFmt = "440sIH%dsH" % (struct.calcsize(mbrPartitionRecordFmt) * 4)
-        assert struct.calcsize(mbrHeaderFmt) == 512
-
-        # struct gpt_entry {
-        #     struct gpt_guid type;
-        #     struct gpt_guid partition_guid;
-        #     uint64_t        lba_start;
-        #     uint64_t        lba_end;
-        #     uint64_t        attrs;
-        #     uint16_t        name[GPT_PART_NAME_LEN];
-        # };
-        gptEntryFmt = "16s16sQQQ36H"
-        assert struct.calcsize(gptEntryFmt) == 128
-
-        # struct gpt_header {
-        #     uint64_t            signature;
-        #     uint32_t            revision;
-        #     uint32_t            size;
-        #     uint32_t            crc32;
-        #     uint32_t            reserved1;
-        #     uint64_t            my_lba;
-        #     uint64_t            alternative_lba;
-        #     uint64_t            first_usable_lba;
-        #     uint64_t            last_usable_lba;
-        #     struct gpt_guid     disk_guid;
-        #     uint64_t            partition_entry_lba;
-        #     uint32_t            npartition_entries;
-        #     uint32_t            sizeof_partition_entry;
-        #     uint32_t            partition_entry_array_crc32;
-        #     uint8_t             reserved2[512 - 92];
-        # };
-        gptHeaderFmt = "QIIIIQQQQ16sQIII420s"
-        assert struct.calcsize(gptHeaderFmt) == 512
-
         # do checking
         diskDevPath, partId = PartiUtil.partiToDiskAndPartiId(devPath)
         with open(diskDevPath, "rb") as f:
+            # protective MBR, GPT header and the leading partition entries are read in one syscall
+            buf = os.pread(f.fileno(), GptUtil._headReadSize, 0)
+
             # get protective MBR
-            mbrHeader = struct.unpack(mbrHeaderFmt, f.read(struct.calcsize(mbrHeaderFmt)))
+            mbrHeader = GptUtil._mbrHeaderStruct.unpack_from(buf, 0)
 
             # check protective MBR header
             if mbrHeader[4] != 0xAA55:
                 return False
 
             # check protective MBR partition entry
-            found = False
             for i in range(0, 4):
-                pRec = struct.unpack_from(mbrPartitionRecordFmt, mbrHeader[3], struct.calcsize(mbrPartitionRecordFmt) * i)
+                pRec = GptUtil._mbrPartitionRecordStruct.unpack_from(mbrHeader[3], GptUtil._mbrPartitionRecordStruct.size * i)
                 if pRec[4] == 0xEE:
-                    found = True
-            if not found:
+                    break
+            else:
                 return False
 
             # get the specified GPT partition entry
-            gptHeader = struct.unpack(gptHeaderFmt, f.read(struct.calcsize(gptHeaderFmt)))
-            f.seek(gptHeader[10] * 512 + struct.calcsize(gptEntryFmt) * (partId - 1))
-            partEntry = struct.unpack(gptEntryFmt, f.read(struct.calcsize(gptEntryFmt)))
+            gptHeader = GptUtil._gptHeaderStruct.unpack_from(buf, GptUtil._mbrHeaderStruct.size)
+            entryOffset = gptHeader[10] * 512 + GptUtil._gptEntryStruct.size * (partId - 1)
+            if entryOffset + GptUtil._gptEntryStruct.size <= len(buf):
+                partEntry = GptUtil._gptEntryStruct.unpack_from(buf, entryOffset)
+            else:
+                partEntry = GptUtil._gptEntryStruct.unpack(os.pread(f.fileno(), GptUtil._gptEntryStruct.size, entryOffset))
 
-            # check partition GUID
-            if partEntry[0] != GptUtil.newGuid("C12A7328-F81F-11D2-BA4B-00A0C93EC93B"):
-                return False
+        # check partition GUID
+        if partEntry[0] != GptUtil._espPartitionTypeGuid:
+            return False
 
         return True
 
 
 class BcacheUtil:
 
+    # structs for the fields of struct cache_sb, compiled once
+    _u64Struct = struct.Struct("Q")
+
+    _sbMagic = bytes([0xc6, 0x85, 0x73, 0xf6, 0x4e, 0x1a, 0x45, 0xca,
+                      0x82, 0x65, 0xf5, 0x7f, 0x48, 0xba, 0x6d, 0x81])
+    _sbHeaderStruct = struct.Struct("QQQ16s")          # cache_sb.csum, offset, version and magic, see C struct definition in makeDevice()
+    _sbStruct = struct.Struct("QQQ16s16s16s32sQQ64sQHHHHIHH")        # struct cache_sb without cache_sb.d
+    assert _sbStruct.size == 208
+
+    # crc table is built once, crcmod uses its C extension when available
+    _crc64Func = crcmod.predefined.mkCrcFun("crc-64-we")
+
+    _bcacheDevPathPattern = re.compile("/dev/(bcache[0-9]+)")
+    _bcacheDevNamePattern = re.compile("bcache[0-9]+")
+    _cacheModePattern = re.compile("\\[(.*)\\]")
+
     @staticmethod
     def getBcacheDevFromDevPath(bcacheDevPath):
-        m = re.fullmatch("/dev/(bcache[0-9]+)", bcacheDevPath)
+        m = BcacheUtil._bcacheDevPathPattern.fullmatch(bcacheDevPath)
         if m is not None:
             return m.group(1)
         else:
             return None
 
+    @staticmethod
+    def getBackingDevDict():
+        # returns {backingDevPath: bcacheDevPath}, built in one walk of /sys/block
+        # "bcache" is a symlink to the bcache directory of the backing device, one readlink() per device is enough
+        ret = dict()
+        with os.scandir("/sys/block") as it:
+            for entry in it:
+                if BcacheUtil._bcacheDevNamePattern.fullmatch(entry.name):
+                    try:
+                        bcachePath = os.readlink(os.path.join(entry.path, "bcache"))
+                    except OSError:
+                        # EINVAL: "bcache" is a directory, this is a flash-only volume which has no backing device
+                        # ENOENT: the bcache device is still being registered
+                        continue
+                    ret[os.path.join("/dev", os.path.basename(os.path.dirname(bcachePath)))] = os.path.join("/dev", entry.name)
+        return ret
+
     @staticmethod
     def makeDevice(devPath, backingDeviceOrCacheDevice, blockSize=None, bucketSize=None, dataOffset=None):
         assert isinstance(backingDeviceOrCacheDevice, bool)
@@ -740,16 +775,10 @@ class BcacheUtil:
         #     };
         #     uint64_t        d[SB_JOURNAL_BUCKETS];    /* journal buckets */
         # };
-        bcacheSbFmt = "QQQ16B16B16B32BQQ8QQHHHHIHH"     # without cache_sb.d
-
-        bcacheSbMagic = [0xc6, 0x85, 0x73, 0xf6, 0x4e, 0x1a, 0x45, 0xca,
-                         0x82, 0x65, 0xf5, 0x7f, 0x48, 0xba, 0x6d, 0x81]
-
         if blockSize is None:
             st = os.stat(devPath)
             if stat.S_ISBLK(st.st_mode):
-                out = Util.cmdCall("blockdev", "--getss", devPath)
-                blockSize = int(out) // 512
+                blockSize = Util.getBlkDevLogicalBlockSize(devPath) // 512
             else:
                 blockSize = st.st_blksize // 512
 
@@ -758,114 +787,58 @@ class BcacheUtil:
         if bucketSize < blockSize:
             raise Exception("bucket size (%d) cannot be smaller than block size (%d)", bucketSize, blockSize)
 
-        devUuid = uuid.uuid4()
-        setUuid = uuid.uuid4()
-
-        bcacheSb = bytearray(struct.calcsize(bcacheSbFmt))
-        offset_content = None
-        offset_version = None
-
-        # cache_sb.csum
-        p = struct.calcsize("Q")
-        offset_content = p
-
-        # cache_sb.offset
-        value = 8               # SB_SECTOR
-        struct.pack_into("Q", bcacheSb, p, value)
-        p += struct.calcsize("Q")
-
-        # cache_sb.version
-        if backingDeviceOrCacheDevice:
-            value = 1           # BCACHE_SB_VERSION_BDEV
-        else:
-            value = 0           # BCACHE_SB_VERSION_CDEV
-        offset_version = p
-        struct.pack_into("Q", bcacheSb, p, value)
-        p += struct.calcsize("Q")
-
-        # cache_sb.magic
-        struct.pack_into("16B", bcacheSb, p, *bcacheSbMagic)
-        p += struct.calcsize("16B")
-
-        # cache_sb.uuid
-        struct.pack_into("16B", bcacheSb, p, *devUuid.bytes)
-        p += struct.calcsize("16B")
-
-        # cache_sb.set_uuid
-        struct.pack_into("16B", bcacheSb, p, *setUuid.bytes)
-        p += struct.calcsize("16B")
-
-        # cache_sb.label
-        p += struct.calcsize("32B")
-
-        # cache_sb.flags
-        if backingDeviceOrCacheDevice:
-            value = 0x01                        # CACHE_MODE_WRITEBACK
-        else:
-            value = 0x00
-        struct.pack_into("Q", bcacheSb, p, value)
-        p += struct.calcsize("Q")
-
-        # cache_sb.seq
-        p += struct.calcsize("Q")
-
-        # cache_sb.pad
-        p += struct.calcsize("8Q")
-
         if backingDeviceOrCacheDevice:
             if dataOffset is not None:
-                # modify cache_sb.version
-                value = 4                       # BCACHE_SB_VERSION_BDEV_WITH_OFFSET
-                struct.pack_into("Q", bcacheSb, offset_version, value)
-
-                # cache_sb.data_offset
-                struct.pack_into("Q", bcacheSb, p, dataOffset)
-                p += struct.calcsize("Q")
+                version = 4                     # BCACHE_SB_VERSION_BDEV_WITH_OFFSET
+                nbucketsOrDataOffset = dataOffset
             else:
-                # cache_sb.data_offset
-                p += struct.calcsize("Q")
+                version = 1                     # BCACHE_SB_VERSION_BDEV
+                nbucketsOrDataOffset = 0
+            flags = 0x01                        # CACHE_MODE_WRITEBACK
+            nrInSet = 0
         else:
-            # cache_sb.nbuckets
-            value = Util.getBlkDevSize(devPath) // 512 // bucketSize
-            if value < 0x80:
-                raise Exception("not enough buckets: %d, need %d", value, 0x80)
-            struct.pack_into("Q", bcacheSb, p, value)
-            p += struct.calcsize("Q")
-
-        # cache_sb.block_size
-        struct.pack_into("H", bcacheSb, p, blockSize)
-        p += struct.calcsize("H")
-
-        # cache_sb.bucket_size
-        struct.pack_into("H", bcacheSb, p, bucketSize)
-        p += struct.calcsize("H")
-
-        # cache_sb.nr_in_set
-        if not backingDeviceOrCacheDevice:
-            value = 1
-            struct.pack_into("H", bcacheSb, p, value)
-            p += struct.calcsize("H")
-
-        # cache_sb.nr_this_dev
-        p += struct.calcsize("H")
-
-        # cache_sb.last_mount
-        p += struct.calcsize("I")
-
-        # cache_sb.first_bucket
-        value = (23 // bucketSize) + 1
-        struct.pack_into("H", bcacheSb, p, value)
-        p += struct.calcsize("H")
+            version = 0                         # BCACHE_SB_VERSION_CDEV
+            nbucketsOrDataOffset = Util.getBlkDevSize(devPath) // 512 // bucketSize
+            if nbucketsOrDataOffset < 0x80:
+                raise Exception("not enough buckets: %d, need %d", nbucketsOrDataOffset, 0x80)
+            flags = 0x00
+            nrInSet = 1
+
+        devUuid = uuid.uuid4()
+        setUuid = uuid.uuid4()
+
+        # all fields are packed in one go, "s" fields shorter than their size are padded with zero
+        bcacheSb = bytearray(BcacheUtil._sbStruct.pack(
+            0,                                  # cache_sb.csum, filled in below
+            8,                                  # cache_sb.offset, SB_SECTOR
+            version,                            # cache_sb.version
+            BcacheUtil._sbMagic,                # cache_sb.magic
+            devUuid.bytes,                      # cache_sb.uuid
+            setUuid.bytes,                      # cache_sb.set_uuid
+            b"",                                # cache_sb.label
+            flags,                              # cache_sb.flags
+            0,                                  # cache_sb.seq
+            b"",                                # cache_sb.pad
+            nbucketsOrDataOffset,               # cache_sb.nbuckets or cache_sb.data_offset
+            blockSize,                          # cache_sb.block_size
+            bucketSize,                         # cache_sb.bucket_size
+            nrInSet,                            # cache_sb.nr_in_set
+            0,                                  # cache_sb.nr_this_dev
+            0,                                  # cache_sb.last_mount
+            (23 // bucketSize) + 1,             # cache_sb.first_bucket
+            0,                                  # cache_sb.njournal_buckets
+        ))
 
         # cache_sb.csum
-        crc64 = crcmod.predefined.Crc("crc-64-we")
-        crc64.update(bcacheSb[offset_content:])
-        struct.pack_into("Q", bcacheSb, 0, crc64.crcValue)
+        BcacheUtil._u64Struct.pack_into(bcacheSb, 0, BcacheUtil._crc64Func(bytes(bcacheSb[8:])))
 
+        # zeroed area before superblock, superblock, zeroed cacbe_sb.d, all in one syscall
+        zeroBuf = memoryview(Util.zeroBuf)
         with open(devPath, "r+b") as f:
-            f.write(bytearray(8 * 512))
-            f.write(bcacheSb)
-            f.write(bytearray(256 * 8))         # cacbe_sb.d
+            os.pwritev(f.fileno(), [zeroBuf[:8 * 512], bcacheSb, zeroBuf[:256 * 8]], 0)
+        Util.invalidateBlkDevInfoCache()
+
+        return str(setUuid)
 
     @staticmethod
     def isBackingDevice(devPath):
@@ -891,14 +864,17 @@ class BcacheUtil:
         BcacheUtil.registerBackingDevice(devPath)
 
     @staticmethod
-    def makeAndRegisterCacheDevice(devPath):
-        BcacheUtil.makeDevice(devPath, False)
-        BcacheUtil.registerCacheDevice(devPath)
+    def makeRegisterAndAttachCacheDevice(cacheDevPath, backingDevPathList):
+        # set UUID is known after making the device, no need to read it back from the superblock
+        setUuid = BcacheUtil.makeDevice(cacheDevPath, False)
+        BcacheUtil.registerCacheDevice(cacheDevPath)
+        BcacheUtil.attachCacheDevice(backingDevPathList, cacheDevPath, setUuid=setUuid)
 
     @staticmethod
-    def attachCacheDevice(backingDevPathList, cacheDevPath):
+    def attachCacheDevice(backingDevPathList, cacheDevPath, setUuid=None):
         if len(backingDevPathList) > 0:
-            setUuid = BcacheUtil.getSetUuid(cacheDevPath)
+            if setUuid is None:
+                setUuid = BcacheUtil.getSetUuid(cacheDevPath)
             for backingDevPath in backingDevPathList:
                 with open("/sys/block/%s/bcache/attach" % (os.path.basename(backingDevPath)), "w") as f:
                     f.write(str(setUuid))
@@ -929,15 +905,15 @@ class BcacheUtil:
 
     @staticmethod
     def getMode(devPath):
-        assert re.fullmatch("/dev/bcache[0-9]+", devPath)
+        assert BcacheUtil._bcacheDevPathPattern.fullmatch(devPath)
         buf = pathlib.Path(os.path.join("/sys", "block", os.path.basename(devPath), "bcache", "cache_mode")).read_text()
-        mode = re.search("\\[(.*)\\]", buf).group(1)
+        mode = BcacheUtil._cacheModePattern.search(buf).group(1)
         assert mode in ["writethrough", "writeback"]
         return mode
 
     @staticmethod
     def setMode(devPath, mode):
-        assert re.fullmatch("/dev/bcache[0-9]+", devPath)
+        assert BcacheUtil._bcacheDevPathPattern.fullmatch(devPath)
         assert mode in ["writethrough", "writeback"]
         with open(os.path.join("/sys", "block", os.path.basename(devPath), "bcache", "cache_mode"), "w") as f:
             f.write(mode)
@@ -966,20 +942,12 @@ class BcacheUtil:
 
         ret = []
         for fn in os.listdir("/dev"):
-            if re.fullmatch("bcache[0-9]+", fn) is not None:
+            if BcacheUtil._bcacheDevNamePattern.fullmatch(fn) is not None:
                 ret.append(os.path.join("/dev", fn))
         return ret
 
     @staticmethod
     def _isBackingDeviceOrCachDevice(devPath, backingDeviceOrCacheDevice):
-        # see C struct definition in makeDevice()
-        bcacheSbMagicPreFmt = "QQQ"
-        bcacheSbMagicFmt = "16B"
-        bcacheSbVersionPreFmt = "QQ"
-        bcacheSbVersionFmt = "Q"
-
-        bcacheSbMagic = [0xc6, 0x85, 0x73, 0xf6, 0x4e, 0x1a, 0x45, 0xca,
-                         0x82, 0x65, 0xf5, 0x7f, 0x48, 0xba, 0x6d, 0x81]
         if backingDeviceOrCacheDevice:
             versionValueList = [
                 1,           # BCACHE_SB_VERSION_BDEV
@@ -991,19 +959,19 @@ class BcacheUtil:
                 3,           # BCACHE_SB_VERSION_CDEV_WITH_UUID
             ]
 
+        # version and magic are adjacent, read them in one go
         with open(devPath, "rb") as f:
-            f.seek(8 * 512 + struct.calcsize(bcacheSbMagicPreFmt))
-            buf = f.read(struct.calcsize(bcacheSbMagicFmt))
-            if list(buf) != bcacheSbMagic:
-                return False
-
-            f.seek(8 * 512 + struct.calcsize(bcacheSbVersionPreFmt))
-            buf = f.read(struct.calcsize(bcacheSbVersionFmt))
-            value = struct.unpack(bcacheSbVersionFmt, buf)[0]
-            if value not in versionValueList:
-                return False
+            f.seek(8 * 512)
+            buf = f.read(BcacheUtil._sbHeaderStruct.size)
+        if len(buf) < BcacheUtil._sbHeaderStruct.size:
+            return False
+        version, magic = BcacheUtil._sbHeaderStruct.unpack(buf)[2:]
+        if magic != BcacheUtil._sbMagic:
+            return False
+        if version not in versionValueList:
+            return False
 
-            return True
+        return True
 
 
 class BcachefsUtil:
@@ -1022,8 +990,11 @@ class BcachefsUtil:
         return (ssdList, hddList)
 
     @staticmethod
-    def createBcachefs(ssdList, hddList):
+    def createBcachefs(ssdList, hddList, dataReplicas, metadataReplicas):
         assert len(hddList) > 0
+        assert dataReplicas > 0 and metadataReplicas > 0
+
+        # all the member devices are formatted by one invocation, no "bcachefs device add" is needed afterwards
 
         cmdList = ["bcachefs", "format"]
         if len(ssdList) > 0:
@@ -1032,19 +1003,23 @@ class BcachefsUtil:
         if True:
             cmdList.append("--group=hdd")
             cmdList += hddList
-        cmdList += ["--data_replicas=1", "--metadata_replicas=1", "--foreground_target=ssd", "--background_target=hdd", "--promote_target=ssd"]
+        cmdList += ["--data_replicas=%d" % (dataReplicas), "--metadata_replicas=%d" % (metadataReplicas)]
+        cmdList += ["--foreground_target=ssd", "--background_target=hdd", "--promote_target=ssd"]
 
         Util.cmdCall(*cmdList)
+        Util.invalidateBlkDevInfoCache()
 
     @staticmethod
     def addSsdToBcachefs(ssd, mountPoint):
         cmdList = ["bcachefs", "device", "add", "--group=ssd", mountPoint, ssd]
         Util.cmdCall(*cmdList)
+        Util.invalidateBlkDevInfoCache()
 
     @staticmethod
     def addHddToBcachefs(hdd, mountPoint):
         cmdList = ["bcachefs", "device", "add", "--group=hdd", mountPoint, hdd]
         Util.cmdCall(*cmdList)
+        Util.invalidateBlkDevInfoCache()
 
     @staticmethod
     def removeDevice(disk, mountPoint):
@@ -1065,9 +1040,10 @@ class BtrfsUtil:
     @staticmethod
     def addDiskToBtrfs(disk, mountPoint):
         with open(disk, "wb") as f:
-            for i in range(0, 1024):
-                f.write(bytearray(4096))            # we found -f is not enough for robustly adding disk
+            for i in range(0, 1024 * 4096 // len(Util.zeroBuf)):
+                f.write(Util.zeroBuf)               # we found -f is not enough for robustly adding disk
         Util.cmdCall("btrfs", "device", "add", "-f", disk, mountPoint)
+        Util.invalidateBlkDevInfoCache()
 
 
 class LvmUtil:
@@ -1100,21 +1076,28 @@ class LvmUtil:
             Util.cmdCall("lvm", "vgcreate", vgName, pvDevPath)
         else:
             Util.cmdCall("lvm", "vgextend", vgName, pvDevPath)
+        Util.invalidateBlkDevInfoCache()
 
     @classmethod
     def removePvFromVg(cls, pvDevPath, vgName):
+        # pvmove returns 0 after the extents are moved, "no data to move" is reported as ECMD_FAILED (5)
+        # it blocks until moving completes, so vgreduce can follow directly
         rc, out = Util.cmdCallWithRetCode("lvm", "pvmove", pvDevPath)
-        if rc != 5:
+        if rc not in [0, 5]:
             raise cls.Error("failed")
 
-        if pvDevPath in LvmUtil.getSlaveDevPathList(vgName):
-            Util.cmdCall("lvm", "vgreduce", vgName, pvDevPath)
+        # rc 5 is also returned for a device which is not a PV of this VG
+        if pvDevPath in cls.getSlaveDevPathList(vgName):
+            rc, out = Util.cmdCallWithRetCode("lvm", "vgreduce", vgName, pvDevPath)
+            if rc != 0:
+                raise cls.Error("failed to remove %s from volume group %s: %s" % (pvDevPath, vgName, out))
 
     @staticmethod
     def createLvWithDefaultSize(vgName, lvName):
         out = Util.cmdCall("lvm", "vgdisplay", "-c", vgName)
         freePe = int(out.split(":")[15])
         Util.cmdCall("lvm", "lvcreate", "-l", "%d" % (freePe // 2), "-n", lvName, vgName)
+        Util.invalidateBlkDevInfoCache()
 
     @staticmethod
     def activateAll():
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import uuid
+import struct
+import shutil
+import tempfile
+import unittest
+import subprocess
+import unittest.mock
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python3"))
+from strict_hdds.util import Util, BcacheUtil
+
+
+class Test_SfdiskScript(unittest.TestCase):
+
+    # partition lists passed to Util.initializeDisk() by EfiMultiDisk.add_disk(),
+    # EfiCacheGroup.add_ssd() and EfiCacheGroup.add_hdd()
+    partitionInfoListDict = {
+        "md_btrfs": [("512MiB", "vfat"), ("*", "btrfs")],
+        "md_lvm": [("512MiB", "vfat"), ("*", "lvm")],
+        "cg_ssd_bcache": [("512MiB", "esp"), ("4GiB", "swap"), ("*", "bcache")],
+        "cg_ssd_bcachefs": [("512MiB", "esp"), ("4GiB", "swap"), ("*", "bcachefs")],
+        "cg_hdd_bcache": [("512MiB", "vfat"), ("*", "bcache")],
+        "cg_hdd_bcachefs": [("512MiB", "vfat"), ("*", "bcachefs")],
+    }
+
+    def test_script(self):
+        script = Util.partitionInfoListToSfdiskScript("gpt", self.partitionInfoListDict["cg_ssd_bcache"])
+        # swap partition on gpt keeps the Linux filesystem data type which libparted produced
+        self.assertEqual(script, "label: gpt\nsize=512MiB, type=U\nsize=4GiB, type=L\ntype=L\n")
+
+        script = Util.partitionInfoListToSfdiskScript("mbr", [("*", "ext4")])
+        self.assertEqual(script, "label: dos\ntype=83\n")
+
+    @unittest.skipIf(shutil.which("sfdisk") is None, "sfdisk is not available")
+    def test_script_parsed_by_sfdisk(self):
+        for name, partitionInfoList in self.partitionInfoListDict.items():
+            with self.subTest(name=name):
+                with tempfile.NamedTemporaryFile() as f:
+                    f.truncate(8 * 1024 * 1024 * 1024)
+                    script = Util.partitionInfoListToSfdiskScript("gpt", partitionInfoList)
+                    subprocess.run(["sfdisk", "--quiet", f.name], input=script, universal_newlines=True, check=True)
+                    out = subprocess.run(["sfdisk", "--json", f.name], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+                    partitions = json.loads(out)["partitiontable"]["partitions"]
+                    self.assertEqual(len(partitions), len(partitionInfoList))
+                    self.assertEqual(partitions[0]["size"], 512 * 1024 * 1024 // 512)
+
+
+class Test_BcacheSuperBlock(unittest.TestCase):
+
+    # field offsets of struct cache_sb in include/uapi/linux/bcache.h
+    fieldOffsetDict = {
+        "csum": (0, "Q"),
+        "offset": (8, "Q"),
+        "version": (16, "Q"),
+        "magic": (24, "16s"),
+        "uuid": (40, "16s"),
+        "set_uuid": (56, "16s"),
+        "label": (72, "32s"),
+        "flags": (104, "Q"),
+        "seq": (112, "Q"),
+        "nbuckets_or_data_offset": (184, "Q"),
+        "block_size": (192, "H"),
+        "bucket_size": (194, "H"),
+        "nr_in_set": (196, "H"),
+        "nr_this_dev": (198, "H"),
+        "last_mount": (200, "I"),
+        "first_bucket": (204, "H"),
+        "njournal_buckets": (206, "H"),
+    }
+
+    def setUp(self):
+        self.tmpFile = tempfile.NamedTemporaryFile()
+        self.tmpFile.truncate(1024 * 1024)
+
+    def tearDown(self):
+        self.tmpFile.close()
+
+    def _readSb(self):
+        with open(self.tmpFile.name, "rb") as f:
+            f.seek(8 * 512)
+            buf = f.read(208)
+        ret = dict()
+        for name, (offset, fmt) in self.fieldOffsetDict.items():
+            ret[name] = struct.unpack_from(fmt, buf, offset)[0]
+        return buf, ret
+
+    def _checkCommon(self, buf, sb):
+        self.assertEqual(sb["csum"], BcacheUtil._crc64Func(buf[8:]))
+        self.assertEqual(sb["offset"], 8)
+        self.assertEqual(sb["magic"], bytes([0xc6, 0x85, 0x73, 0xf6, 0x4e, 0x1a, 0x45, 0xca, 0x82, 0x65, 0xf5, 0x7f, 0x48, 0xba, 0x6d, 0x81]))
+        self.assertEqual(sb["label"], bytes(32))
+        self.assertEqual(sb["seq"], 0)
+        self.assertEqual(buf[120:184], bytes(64))
+        self.assertEqual(sb["block_size"], 8)
+        self.assertEqual(sb["bucket_size"], 1024)
+        self.assertEqual(sb["nr_this_dev"], 0)
+        self.assertEqual(sb["last_mount"], 0)
+        self.assertEqual(sb["first_bucket"], 1)
+        self.assertEqual(sb["njournal_buckets"], 0)
+
+    def test_backing_device(self):
+        BcacheUtil.makeDevice(self.tmpFile.name, True, blockSize=8)
+        buf, sb = self._readSb()
+        self._checkCommon(buf, sb)
+        self.assertEqual(sb["version"], 1)                  # BCACHE_SB_VERSION_BDEV
+        self.assertEqual(sb["flags"], 0x01)                 # CACHE_MODE_WRITEBACK
+        self.assertEqual(sb["nbuckets_or_data_offset"], 0)
+        self.assertEqual(sb["nr_in_set"], 0)
+
+        self.assertTrue(BcacheUtil.isBackingDevice(self.tmpFile.name))
+        self.assertFalse(BcacheUtil.isCacheDevice(self.tmpFile.name))
+
+    def test_backing_device_with_offset(self):
+        BcacheUtil.makeDevice(self.tmpFile.name, True, blockSize=8, dataOffset=64)
+        buf, sb = self._readSb()
+        self._checkCommon(buf, sb)
+        self.assertEqual(sb["version"], 4)                  # BCACHE_SB_VERSION_BDEV_WITH_OFFSET
+        self.assertEqual(sb["nbuckets_or_data_offset"], 64)
+
+        self.assertTrue(BcacheUtil.isBackingDevice(self.tmpFile.name))
+
+    def test_cache_device(self):
+        with unittest.mock.patch.object(Util, "getBlkDevSize", return_value=1024 * 1024 * 1024):
+            setUuid = BcacheUtil.makeDevice(self.tmpFile.name, False, blockSize=8)
+        buf, sb = self._readSb()
+        self._checkCommon(buf, sb)
+        self.assertEqual(sb["version"], 0)                  # BCACHE_SB_VERSION_CDEV
+        self.assertEqual(sb["flags"], 0x00)
+        self.assertEqual(sb["nbuckets_or_data_offset"], 1024 * 1024 * 1024 // 512 // 1024)
+        self.assertEqual(sb["nr_in_set"], 1)
+        self.assertEqual(str(uuid.UUID(bytes=sb["set_uuid"])), setUuid)
+
+        self.assertTrue(BcacheUtil.isCacheDevice(self.tmpFile.name))
+        self.assertFalse(BcacheUtil.isBackingDevice(self.tmpFile.name))
+        self.assertEqual(BcacheUtil.getSetUuid(self.tmpFile.name), setUuid)
+
+
+
+class Test_BcacheBackingDevDict(unittest.TestCase):
+
+    def setUp(self):
+        # fake /sys/block
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.sysBlockDir = os.path.join(self.tmpDir.name, "block")
+        os.makedirs(self.sysBlockDir)
+
+        # bcache0 is a registered backing device, sdb2/bcache is the bcache directory of it
+        os.makedirs(os.path.join(self.tmpDir.name, "devices", "sdb", "sdb2", "bcache"))
+        os.makedirs(os.path.join(self.sysBlockDir, "bcache0"))
+        os.symlink("../../devices/sdb/sdb2/bcache", os.path.join(self.sysBlockDir, "bcache0", "bcache"))
+
+        # bcache1 is a flash-only volume, "bcache" is a real directory
+        os.makedirs(os.path.join(self.sysBlockDir, "bcache1", "bcache"))
+
+        # bcache2 is still being registered, "bcache" does not exist yet
+        os.makedirs(os.path.join(self.sysBlockDir, "bcache2"))
+
+        # not a bcache device
+        os.makedirs(os.path.join(self.sysBlockDir, "sdb"))
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_get_backing_dev_dict(self):
+        realScandir = os.scandir
+        with unittest.mock.patch("strict_hdds.util.os.scandir", lambda path: realScandir(self.sysBlockDir)):
+            ret = BcacheUtil.getBackingDevDict()
+        self.assertEqual(ret, {"/dev/sdb2": "/dev/bcache0"})
+
+
+if __name__ == "__main__":
+    unittest.main()